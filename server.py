@@ -1,14 +1,33 @@
 #!/usr/bin/env python3
 import http.server
-import socketserver
 import os
+import stat
+import gzip
 import json
+import html
 import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
 import re
 import time
+import threading
+import queue
+import itertools
+import functools
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+
+# Prefer orjson when available: it parses bytes and returns bytes directly
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
 
 # Change to the directory containing the HTML files
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -17,13 +36,90 @@ PORT = 5000
 HOST = "0.0.0.0"
 
 # Rate limiting - track requests per IP
-rate_limit_tracker = defaultdict(list)
 RATE_LIMIT_WINDOW = 300  # 5 minutes
 RATE_LIMIT_MAX_REQUESTS = 3  # Max 3 requests per 5 minutes per IP
+# PERF: keep defaultdict(...). Do NOT change to {}.setdefault(ip, deque()).append(...) -
+# setdefault always constructs its default argument, allocating a throwaway deque on
+# every request instead of once per new IP.
+rate_limit_tracker = defaultdict(lambda: deque(maxlen=RATE_LIMIT_MAX_REQUESTS))
+rate_limit_lock = threading.Lock()  # handler threads share rate_limit_tracker
+RATE_LIMIT_SWEEP_EVERY = 10000  # Drop expired IPs every N checks
+RATE_LIMIT_MAX_TRACKED_IPS = 100000  # Hard ceiling against IP-spray floods
+rate_limit_checks = itertools.count()
+
+class ByteLRU:
+    """Thread-safe LRU cache bounded by the total byte size of its values"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.cur = 0
+        self.d = OrderedDict()  # key -> (value, size)
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.d.get(key)
+            if entry is None:
+                return None
+            self.d.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.d.pop(key, None)
+            if old is not None:
+                self.cur -= old[1]
+            self.d[key] = (value, size)
+            self.cur += size
+            # Evict least recently used entries until back under budget
+            while self.cur > self.max_bytes:
+                _, (_, evicted_size) = self.d.popitem(last=False)
+                self.cur -= evicted_size
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+def is_compressible(content_type):
+    """Text-like content types that gzip well"""
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+# Static files at or below this size are served from memory; larger ones via sendfile
+STATIC_CACHE_MAX_FILE = 256 * 1024
+static_cache = ByteLRU(32 * 1024 * 1024)  # path -> (mtime_ns, size, body, gzip_body)
+
+# Loan request validation
+MAX_BODY_SIZE = 10000  # 10KB limit
+REQUIRED_FIELDS = ('book_title', 'book_author', 'borrower_name', 'borrower_email')
+SANITIZED_FIELDS = ('book_title', 'book_author', 'borrower_name')
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+EMAIL_MAX_LENGTH = 254  # RFC 5321 path limit
+# Characters stripped from free-text fields (basic HTML/quote removal)
+SANITIZE_TABLE = str.maketrans('', '', '<>"\'')
+
+# Error responses are serialized once; validation messages come from a small fixed set
+@functools.lru_cache(maxsize=64)
+def error_body(error_msg):
+    """Serialized JSON error response body"""
+    return json_dumps({"success": False, "error": error_msg})
+
+QUEUED_BODY = json_dumps({"success": True, "queued": True, "message": "Notification queued"})
+MAIL_DISABLED_BODY = error_body("Notification service not configured")
+MAIL_BUSY_BODY = error_body("Notification service busy. Please try again later.")
+RATE_LIMIT_BODY = error_body("Rate limit exceeded. Please try again later.")
+TOO_LARGE_BODY = error_body("Request too large")
+LENGTH_REQUIRED_BODY = error_body("Content-Length required")
+BAD_LENGTH_BODY = error_body("Invalid Content-Length")
+INVALID_JSON_BODY = error_body("Invalid JSON")
 
 # Email notification functionality using Replit Mail integration
+MAIL_URL = "https://connectors.replit.com/api/v2/mailer/send"
+MAIL_TIMEOUT = (3, 10)  # Seconds to connect, seconds to read
+
 def get_auth_token():
-    """Get authentication token for Replit services"""
+    """Get authentication token for Replit services, or None outside Replit"""
     repl_identity = os.environ.get('REPL_IDENTITY')
     web_repl_renewal = os.environ.get('WEB_REPL_RENEWAL')
     
@@ -32,78 +128,141 @@ def get_auth_token():
     elif web_repl_renewal:
         return f"depl {web_repl_renewal}"
     else:
-        raise Exception("No authentication token found. Ensure you're running in Replit environment.")
+        return None
 
-def send_loan_notification(book_title, book_author, borrower_name, borrower_email):
-    """Send loan notification email using Replit Mail service"""
-    # Get admin email from environment variable - never trust client input for recipient
-    admin_email = os.environ.get('ADMIN_EMAIL')
-    if not admin_email:
-        print("⚠️  No ADMIN_EMAIL configured in environment")
-        return {"success": False, "error": "Admin email not configured"}
-    
-    try:
-        auth_token = get_auth_token()
-        
-        # Compose email content
-        subject = f"📚 Nuevo Préstamo - {book_title}"
-        text_content = f"""
-¡Hola!
+# Mail configuration is read once at startup.
+# Admin email comes from the environment - never trust client input for recipient
+ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
+AUTH_TOKEN = get_auth_token()
+if not ADMIN_EMAIL:
+    print("⚠️  No ADMIN_EMAIL configured in environment; loan notifications are disabled")
+if not AUTH_TOKEN:
+    print("⚠️  No authentication token found. Ensure you're running in Replit environment.")
 
-Se ha registrado un nuevo préstamo en la biblioteca digital gehitubib:
+# Shared session so the TCP/TLS connection to the mailer is reused across notifications
+MAIL_SESSION = requests.Session()
+MAIL_SESSION.headers.update({"Content-Type": "application/json"})
+if AUTH_TOKEN:
+    MAIL_SESSION.headers["X-Replit-Token"] = AUTH_TOKEN
+MAIL_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # Retry connect errors and gateway statuses only; a read timeout may mean the
+    # mailer already accepted the POST, so retrying it could send a duplicate email.
+    # read=False (not 0) re-raises the read error itself, surfacing as requests.ReadTimeout
+    # rather than a MaxRetryError wrapped in requests.ConnectionError.
+    max_retries=Retry(
+        total=2,
+        read=False,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,
+    ),
+))
 
-📖 Libro: {book_title}
+# Loan notification email bodies, filled with str.format_map.
+# One entry is rendered per loan; a batch of loans shares one email.
+LOAN_TEXT_ENTRY = """📖 Libro: {book_title}
 ✍️ Autor: {book_author}
 👤 Usuario: {borrower_name}
 📧 Email: {borrower_email}
-📅 Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}
+📅 Fecha: {date}"""
+
+LOAN_TEXT_TEMPLATE = """¡Hola!
+
+{intro}
 
-Puedes gestionar este préstamo desde el panel de administración.
+{entries}
+
+Puedes gestionar {manage} desde el panel de administración.
 
 Saludos,
-Sistema de Biblioteca gehitubib
-        """.strip()
-        
-        html_content = f"""
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-            <h2 style="color: #9b59b6;">📚 Nuevo Préstamo - gehitubib</h2>
-            
-            <div style="background: #f8f9fa; border-left: 4px solid #9b59b6; padding: 20px; margin: 20px 0;">
-                <h3 style="margin-top: 0; color: #333;">Detalles del Préstamo</h3>
-                <p><strong>📖 Libro:</strong> {book_title}</p>
-                <p><strong>✍️ Autor:</strong> {book_author}</p>
-                <p><strong>👤 Usuario:</strong> {borrower_name}</p>
-                <p><strong>📧 Email:</strong> {borrower_email}</p>
-                <p><strong>📅 Fecha:</strong> {datetime.now().strftime('%d/%m/%Y %H:%M')}</p>
-            </div>
-            
-            <p>Puedes gestionar este préstamo desde el panel de administración de la biblioteca.</p>
-            
-            <hr style="border: none; border-top: 1px solid #eee; margin: 30px 0;">
-            <p style="color: #666; font-size: 14px;">
-                Sistema de Biblioteca Digital gehitubib
-            </p>
-        </div>
-        """
+Sistema de Biblioteca gehitubib"""
+
+LOAN_HTML_ENTRY = """
+    <div style="background: #f8f9fa; border-left: 4px solid #9b59b6; padding: 20px; margin: 20px 0;">
+        <h3 style="margin-top: 0; color: #333;">Detalles del Préstamo</h3>
+        <p><strong>📖 Libro:</strong> {book_title}</p>
+        <p><strong>✍️ Autor:</strong> {book_author}</p>
+        <p><strong>👤 Usuario:</strong> {borrower_name}</p>
+        <p><strong>📧 Email:</strong> {borrower_email}</p>
+        <p><strong>📅 Fecha:</strong> {date}</p>
+    </div>
+"""
+
+LOAN_HTML_TEMPLATE = """
+<div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+    <h2 style="color: #9b59b6;">📚 {heading} - gehitubib</h2>
+    {entries}
+    <p>Puedes gestionar {manage} desde el panel de administración de la biblioteca.</p>
+    
+    <hr style="border: none; border-top: 1px solid #eee; margin: 30px 0;">
+    <p style="color: #666; font-size: 14px;">
+        Sistema de Biblioteca Digital gehitubib
+    </p>
+</div>
+"""
+
+# Notifications are queued and sent in batches by a background thread, so clients
+# don't wait on the mailer and a burst of loans costs one mailer call
+MAIL_QUEUE_MAX = 100  # Pending notifications before rejecting with 503
+MAIL_BATCH_MAX = 16  # Loans per email
+MAIL_BATCH_WINDOW = 0.25  # Seconds to wait for more loans after the first
+MAIL_MAX_ATTEMPTS = 3  # Sends per batch when the mailer is unreachable
+MAIL_RETRY_DELAY = 5  # Seconds before the first resend, growing linearly
+mail_queue = queue.Queue(maxsize=MAIL_QUEUE_MAX)
+
+def send_loan_notifications(loans):
+    """Send one email covering a batch of loans using Replit Mail service"""
+    if not ADMIN_EMAIL:
+        print("⚠️  No ADMIN_EMAIL configured in environment")
+        return {"success": False, "error": "Admin email not configured"}
+    if not AUTH_TOKEN:
+        print("⚠️  No authentication token configured")
+        return {"success": False, "error": "Authentication token not configured"}
+    
+    try:
+        # Compose email content (user fields are escaped for the HTML body)
+        if len(loans) == 1:
+            subject = f"📚 Nuevo Préstamo - {loans[0]['book_title']}"
+            intro = "Se ha registrado un nuevo préstamo en la biblioteca digital gehitubib:"
+            heading = "Nuevo Préstamo"
+            manage = "este préstamo"
+        else:
+            subject = f"📚 {len(loans)} Nuevos Préstamos"
+            intro = f"Se han registrado {len(loans)} nuevos préstamos en la biblioteca digital gehitubib:"
+            heading = "Nuevos Préstamos"
+            manage = "estos préstamos"
+        text_content = LOAN_TEXT_TEMPLATE.format_map({
+            "intro": intro,
+            "entries": "\n\n".join(LOAN_TEXT_ENTRY.format_map(loan) for loan in loans),
+            "manage": manage,
+        })
+        html_content = LOAN_HTML_TEMPLATE.format_map({
+            "heading": heading,
+            "entries": "".join(
+                LOAN_HTML_ENTRY.format_map({key: html.escape(value) for key, value in loan.items()})
+                for loan in loans
+            ),
+            "manage": manage,
+        })
         
         payload = {
-            "to": admin_email,
+            "to": ADMIN_EMAIL,
             "subject": subject,
             "text": text_content,
             "html": html_content
         }
         
-        response = requests.post(
-            "https://connectors.replit.com/api/v2/mailer/send",
-            headers={
-                "Content-Type": "application/json",
-                "X-Replit-Token": auth_token,
-            },
-            json=payload
+        response = MAIL_SESSION.post(
+            MAIL_URL,
+            json=payload,
+            timeout=MAIL_TIMEOUT
         )
         
         if response.status_code == 200:
-            print(f"✅ Email notification sent successfully to {admin_email}")
+            print(f"✅ Email notification for {len(loans)} loan(s) sent successfully to {ADMIN_EMAIL}")
             return {"success": True, "message": "Notification sent successfully"}
         else:
             try:
@@ -114,16 +273,67 @@ Sistema de Biblioteca gehitubib
             print(f"❌ Failed to send email notification: {error_msg}")
             return {"success": False, "error": error_msg}
             
+    except requests.ConnectionError as e:
+        # Exhausted urllib3 retries arrive as ConnectionError wrapping MaxRetryError;
+        # a read timeout underneath still means the mailer may have the email
+        reason = e.args[0].reason if e.args and isinstance(e.args[0], MaxRetryError) else None
+        if isinstance(reason, ReadTimeoutError):
+            print(f"❌ Email service timed out: {str(e)}")
+            return {"success": False, "error": "Email service timed out"}
+        # Connect failures and timeouts: the mailer never got the request, so resending is safe
+        print(f"❌ Email service unreachable: {str(e)}")
+        return {"success": False, "error": "Email service unavailable", "retryable": True}
+    except requests.Timeout as e:
+        # Read timeout (the session's read=False surfaces it as requests.ReadTimeout):
+        # the mailer may have accepted the email, so don't resend
+        print(f"❌ Email service timed out: {str(e)}")
+        return {"success": False, "error": "Email service timed out"}
     except Exception as e:
-        print(f"❌ Exception in send_loan_notification: {str(e)}")
+        print(f"❌ Exception in send_loan_notifications: {str(e)}")
         return {"success": False, "error": str(e)}
 
+def queue_loan_notification(book_title, book_author, borrower_name, borrower_email):
+    """Queue a notification for the mail worker; returns False when the queue is full"""
+    loan = {
+        "book_title": book_title,
+        "book_author": book_author,
+        "borrower_name": borrower_name,
+        "borrower_email": borrower_email,
+        "date": datetime.now().strftime('%d/%m/%Y %H:%M'),
+    }
+    try:
+        mail_queue.put_nowait(loan)
+    except queue.Full:
+        return False
+    return True
+
+def mail_worker():
+    """Drain mail_queue forever, sending up to MAIL_BATCH_MAX loans per email"""
+    while True:
+        loans = [mail_queue.get()]
+        deadline = time.monotonic() + MAIL_BATCH_WINDOW
+        while len(loans) < MAIL_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                loans.append(mail_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        for attempt in range(1, MAIL_MAX_ATTEMPTS + 1):
+            result = send_loan_notifications(loans)
+            if not result.get('retryable'):
+                break
+            if attempt == MAIL_MAX_ATTEMPTS:
+                print(f"❌ Giving up on {len(loans)} loan notification(s) after {attempt} attempts")
+                break
+            # Back off; new requests get 503 from the full queue meanwhile
+            time.sleep(MAIL_RETRY_DELAY * attempt)
+
 def validate_loan_request(data):
     """Validate and sanitize loan notification request"""
-    required_fields = ['book_title', 'book_author', 'borrower_name', 'borrower_email']
-    
     # Check required fields
-    for field in required_fields:
+    for field in REQUIRED_FIELDS:
         if field not in data or not data[field]:
             return False, f"Missing required field: {field}"
     
@@ -135,125 +345,266 @@ def validate_loan_request(data):
     if len(data['borrower_name']) > 100:
         return False, "Borrower name too long (max 100 characters)"
     
-    # Email validation
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_pattern, data['borrower_email']):
+    # Email validation (length first so the regex never sees oversized input)
+    if len(data['borrower_email']) > EMAIL_MAX_LENGTH:
+        return False, "Borrower email too long (max 254 characters)"
+    if not EMAIL_RE.match(data['borrower_email']):
         return False, "Invalid borrower email format"
     
     # Sanitize text fields (basic HTML/special character removal)
-    for field in ['book_title', 'book_author', 'borrower_name']:
-        data[field] = re.sub(r'[<>"\']', '', data[field]).strip()
+    for field in SANITIZED_FIELDS:
+        data[field] = data[field].translate(SANITIZE_TABLE).strip()
     
     return True, "Valid"
 
+def sweep_rate_limit(current_time):
+    """Forget IPs with no requests inside the window. Caller holds rate_limit_lock."""
+    for client_ip, timestamps in list(rate_limit_tracker.items()):
+        if not timestamps or current_time - timestamps[-1] >= RATE_LIMIT_WINDOW:
+            del rate_limit_tracker[client_ip]
+
 def check_rate_limit(client_ip):
     """Check if client IP is within rate limits"""
     current_time = time.time()
     
-    # Clean old entries
-    rate_limit_tracker[client_ip] = [
-        timestamp for timestamp in rate_limit_tracker[client_ip]
-        if current_time - timestamp < RATE_LIMIT_WINDOW
-    ]
-    
-    # Check if within limits
-    if len(rate_limit_tracker[client_ip]) >= RATE_LIMIT_MAX_REQUESTS:
-        return False
-    
-    # Add current request
-    rate_limit_tracker[client_ip].append(current_time)
-    return True
+    with rate_limit_lock:
+        # Spread cleanup across requests so the tracker doesn't grow with every IP ever seen
+        if next(rate_limit_checks) % RATE_LIMIT_SWEEP_EVERY == 0:
+            sweep_rate_limit(current_time)
+        
+        # At the ceiling, make room by evicting the oldest-inserted IP in O(1);
+        # sweeping here would cost a full scan per request during an IP spray
+        if client_ip not in rate_limit_tracker and len(rate_limit_tracker) >= RATE_LIMIT_MAX_TRACKED_IPS:
+            del rate_limit_tracker[next(iter(rate_limit_tracker))]
+        
+        timestamps = rate_limit_tracker[client_ip]
+        
+        # Clean old entries (oldest are on the left)
+        while timestamps and current_time - timestamps[0] >= RATE_LIMIT_WINDOW:
+            timestamps.popleft()
+        
+        # Check if within limits
+        if len(timestamps) >= RATE_LIMIT_MAX_REQUESTS:
+            return False
+        
+        # Add current request
+        timestamps.append(current_time)
+        return True
+
+# Headers added to every response, encoded once
+COMMON_HEADERS = b"".join(f"{name}: {value}\r\n".encode('latin-1') for name, value in (
+    # Cache control headers to prevent caching issues in iframe
+    ('Cache-Control', 'no-cache, no-store, must-revalidate'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0'),
+    # Allow CORS for API calls
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+))
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Socket timeout so a stalled client can't hold a handler thread forever
+    timeout = 15
+    
     def end_headers(self):
-        # Add cache control headers to prevent caching issues in iframe
-        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
-        # Allow CORS for API calls
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        # Append the pre-encoded common headers in one go instead of six send_header calls
+        # (same buffer send_header writes to; HTTP/0.9 responses carry no headers)
+        if self.request_version != 'HTTP/0.9':
+            if not hasattr(self, '_headers_buffer'):
+                self._headers_buffer = []
+            self._headers_buffer.append(COMMON_HEADERS)
         super().end_headers()
     
+    def do_GET(self):
+        """Serve regular files from memory or with sendfile; everything else goes to the stock handler"""
+        path = self.translate_path(self.path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return super().do_GET()
+        if not stat.S_ISREG(st.st_mode) or urllib.parse.urlsplit(self.path).path.endswith('/'):
+            return super().do_GET()
+        
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        gzip_etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}-gz"'
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            matched = etag if ('*' in tags or etag in tags) else gzip_etag if gzip_etag in tags else None
+            if matched:
+                self.send_response(304)
+                self.send_header('ETag', matched)
+                self.end_headers()
+                return
+        
+        if st.st_size <= STATIC_CACHE_MAX_FILE:
+            cached = static_cache.get(path)
+            if cached is None or cached[:2] != (st.st_mtime_ns, st.st_size):
+                try:
+                    with open(path, 'rb') as f:
+                        body = f.read()
+                except OSError:
+                    self.send_error(404, "File not found")
+                    return
+                # Compress once at cache fill time; None when it isn't worth it
+                gzip_body = None
+                if len(body) >= GZIP_MIN_SIZE and is_compressible(self.guess_type(path)):
+                    gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+                    if len(gzip_body) >= len(body):
+                        gzip_body = None
+                cached = (st.st_mtime_ns, st.st_size, body, gzip_body)
+                static_cache.put(path, cached, len(body) + len(gzip_body or b''))
+            body, gzip_body = cached[2], cached[3]
+            if gzip_body is not None and self.accepts_gzip():
+                self.send_static_headers(path, st, gzip_etag, len(gzip_body), encoding='gzip')
+                self.wfile.write(gzip_body)
+            else:
+                self.send_static_headers(path, st, etag, len(body), vary=gzip_body is not None)
+                self.wfile.write(body)
+            return
+        
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            self.send_static_headers(path, st, etag, st.st_size)
+            # Zero-copy from the page cache to the socket
+            self.connection.sendfile(f)
+    
+    def send_static_headers(self, path, st, etag, length, encoding=None, vary=False):
+        """Send the 200 status line and headers for a static file"""
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(length))
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        self.send_header('ETag', etag)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if encoding or vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+    
+    def accepts_gzip(self):
+        """Whether the client's Accept-Encoding allows a gzip body"""
+        gzip_q = wildcard_q = None
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, *params = coding.split(';')
+            name = name.strip().lower()
+            if name not in ('gzip', '*'):
+                continue
+            q = 1.0
+            for param in params:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        q = float(value.strip())
+                    except ValueError:
+                        q = 0.0
+            if name == 'gzip':
+                gzip_q = q
+            else:
+                wildcard_q = q
+        # An explicit gzip entry overrides the wildcard
+        q = gzip_q if gzip_q is not None else wildcard_q
+        return q is not None and q > 0
+    
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
         self.end_headers()
     
+    def send_json(self, status, body, close=False):
+        """Send a pre-serialized JSON body; close=True when the request body was left unread"""
+        compressed = len(body) >= GZIP_MIN_SIZE and self.accepts_gzip()
+        if compressed:
+            body = gzip.compress(body, compresslevel=6, mtime=0)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        if close:
+            self.send_header('Connection', 'close')  # also sets close_connection
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_POST(self):
         """Handle POST requests for API endpoints"""
         if self.path == '/api/loan-notification':
-            # Handle loan notification with security measures
+            # Handle loan notification with security measures. Header checks and
+            # rate limiting run before the body is read, so rejected requests never
+            # cost a read or a JSON parse.
+            
+            # Content length check, done up front without exception-driven parsing
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                self.send_json(411, LENGTH_REQUIRED_BODY, close=True)
+                return
+            if not (content_length.isascii() and content_length.isdigit()):
+                self.send_json(400, BAD_LENGTH_BODY, close=True)
+                return
+            # Compare digit counts first: int() refuses strings over 4300 digits
+            digits = content_length.lstrip('0') or '0'
+            if len(digits) > len(str(MAX_BODY_SIZE)) or int(digits) > MAX_BODY_SIZE:
+                self.send_json(413, TOO_LARGE_BODY, close=True)
+                return
+            content_length = int(digits)
+            
+            # Mail configuration is fixed at startup; don't queue what can't be sent
+            if not (ADMIN_EMAIL and AUTH_TOKEN):
+                self.send_json(503, MAIL_DISABLED_BODY, close=True)
+                return
+            
             try:
-                # Rate limiting check
+                # Rate limiting check (body stays unread on rejection)
                 client_ip = self.client_address[0]
                 if not check_rate_limit(client_ip):
-                    self.send_response(429)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    response = {"success": False, "error": "Rate limit exceeded. Please try again later."}
-                    self.wfile.write(json.dumps(response).encode('utf-8'))
-                    return
-                
-                # Content length check
-                content_length = int(self.headers['Content-Length'])
-                if content_length > 10000:  # 10KB limit
-                    self.send_response(413)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    response = {"success": False, "error": "Request too large"}
-                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    self.send_json(429, RATE_LIMIT_BODY, close=True)
                     return
                 
                 # Parse and validate JSON
                 post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
+                data = json_loads(post_data)
                 
                 # Validate and sanitize input
                 is_valid, error_msg = validate_loan_request(data)
                 if not is_valid:
-                    self.send_response(400)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    response = {"success": False, "error": error_msg}
-                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    self.send_json(400, error_body(error_msg))
                     return
                 
                 # Log the notification request (sanitized)
                 print(f"📧 Processing loan notification for book: {data['book_title'][:50]}... from IP: {client_ip}")
                 
-                # Send notification
-                result = send_loan_notification(
+                # Queue notification; the mail worker reports the outcome in the log
+                queued = queue_loan_notification(
                     data['book_title'], 
                     data['book_author'],
                     data['borrower_name'],
                     data['borrower_email']
                 )
                 
-                self.send_response(200 if result['success'] else 500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(result).encode('utf-8'))
+                if queued:
+                    self.send_json(202, QUEUED_BODY)
+                else:
+                    self.send_json(503, MAIL_BUSY_BODY)
                 
-            except json.JSONDecodeError:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                response = {"success": False, "error": "Invalid JSON"}
-                self.wfile.write(json.dumps(response).encode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self.send_json(400, INVALID_JSON_BODY)
             except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                response = {"success": False, "error": str(e)}
-                self.wfile.write(json.dumps(response).encode('utf-8'))
+                self.send_json(500, error_body(str(e)))
         else:
             # For non-API POST requests, return 404
             self.send_response(404)
             self.end_headers()
 
-with socketserver.TCPServer((HOST, PORT), MyHTTPRequestHandler) as httpd:
+threading.Thread(target=mail_worker, name="mail", daemon=True).start()
+
+# One thread per connection (daemon threads, SO_REUSEADDR are the defaults)
+with http.server.ThreadingHTTPServer((HOST, PORT), MyHTTPRequestHandler) as httpd:
     print(f"Serving at http://{HOST}:{PORT}")
     print("API endpoint available at /api/loan-notification")
     httpd.serve_forever()
\ No newline at end of file